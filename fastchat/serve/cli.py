@@ -13,13 +13,27 @@ import argparse
 import os
 import re
 import sys
+import time
+
+# Hide unwanted GPUs before `fastchat.serve.inference` (and through it,
+# torch) is imported below; otherwise CUDA initializes a context on every
+# visible device before main() gets a chance to set the environment. Only
+# applies when run as a script, so importing this module as a library
+# leaves the environment untouched.
+if __name__ == "__main__":
+    _gpu_parser = argparse.ArgumentParser(add_help=False)
+    _gpu_parser.add_argument("--gpus", type=str, default=None)
+    _gpus = _gpu_parser.parse_known_args()[0].gpus
+    if _gpus:
+        os.environ["CUDA_VISIBLE_DEVICES"] = _gpus
+        os.environ["XPU_VISIBLE_DEVICES"] = _gpus
 
 from prompt_toolkit import PromptSession
 from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
-from prompt_toolkit.completion import WordCompleter
+from prompt_toolkit.completion import Completer, Completion
 from prompt_toolkit.history import InMemoryHistory
 from prompt_toolkit.key_binding import KeyBindings
-from rich.console import Console
+from rich.console import Console, Group
 from rich.live import Live
 from rich.markdown import Markdown
 
@@ -28,6 +42,60 @@ from fastchat.modules.gptq import GptqConfig
 from fastchat.serve.inference import ChatIO, chat_loop
 
 
+class _CommandCompleter(Completer):
+    """Complete the two !!-commands without running a regex per keystroke."""
+
+    _commands = ["!!exit", "!!reset"]
+
+    def get_completions(self, document, complete_event):
+        text = document.text_before_cursor
+        if not text.startswith("!"):
+            return
+        for command in self._commands:
+            if command.startswith(text):
+                yield Completion(command, start_position=-len(text))
+
+
+# Shared across RichChatIO instances; both are stateless.
+_COMPLETER = _CommandCompleter()
+_AUTO_SUGGEST = AutoSuggestFromHistory()
+
+# Default prompt file for the "programmatic" style, resolved once at import.
+_DEFAULT_INPUT_PATH = os.path.abspath(os.path.join("inputs", "input_prompt.txt"))
+
+
+def _stream_output_to_stdout(output_stream):
+    """Stream a token iterator to stdout and return the full text.
+
+    Keeps a character offset into the cumulative text instead of
+    re-splitting the whole output on every chunk, so each iteration only
+    touches the newly generated tail. Completed words are buffered and
+    flushed at bounded intervals rather than paying a write+flush syscall
+    per token.
+    """
+    write = sys.stdout.buffer.write
+    buf = bytearray()
+    last_flush = time.monotonic()
+    pre = 0
+    text = ""
+    for outputs in output_stream:
+        text = outputs["text"]
+        now = text.rfind(" ", pre)
+        if now > pre:
+            buf += text[pre : now + 1].encode()
+            pre = now + 1
+        elapsed = time.monotonic()
+        if len(buf) > 4096 or elapsed - last_flush > 0.1:
+            write(buf)
+            sys.stdout.flush()
+            buf.clear()
+            last_flush = elapsed
+    buf += (text[pre:] + "\n").encode()
+    write(buf)
+    sys.stdout.flush()
+    return text
+
+
 class SimpleChatIO(ChatIO):
     def __init__(self, multiline: bool = False):
         self._multiline = multiline
@@ -36,34 +104,25 @@ class SimpleChatIO(ChatIO):
         if not self._multiline:
             return input(f"{role}: ")
 
-        prompt_data = []
-        line = input(f"{role} [ctrl-d/z on empty line to end]: ")
-        while True:
-            prompt_data.append(line.strip())
-            try:
-                line = input()
-            except EOFError as e:
-                break
-        return "\n".join(prompt_data)
+        # Read the remaining lines in a single batched read instead of one
+        # input() round-trip per line; sys.stdin.read() returns at EOF
+        # (ctrl-d/z) with all lines already newline-delimited.
+        first_line = input(f"{role} [ctrl-d/z on empty line to end]: ")
+        rest = sys.stdin.read()
+        prompt_data = [first_line] + rest.splitlines()
+        return "\n".join(line.strip() for line in prompt_data)
 
     def prompt_for_output(self, role: str):
-        print(f"{role}: ", end="", flush=True)
+        sys.stdout.write(f"{role}: ")
+        sys.stdout.flush()
 
     def stream_output(self, output_stream):
-        pre = 0
-        for outputs in output_stream:
-            output_text = outputs["text"]
-            output_text = output_text.strip().split(" ")
-            now = len(output_text) - 1
-            if now > pre:
-                print(" ".join(output_text[pre:now]), end=" ", flush=True)
-                pre = now
-        print(" ".join(output_text[pre:]), flush=True)
-        return " ".join(output_text)
+        return _stream_output_to_stdout(output_stream)
 
 
 class RichChatIO(ChatIO):
     bindings = KeyBindings()
+    _FENCE_RE = re.compile(r"^```", re.MULTILINE)
 
     @bindings.add("escape", "enter")
     def _(event):
@@ -71,9 +130,7 @@ class RichChatIO(ChatIO):
 
     def __init__(self, multiline: bool = False, mouse: bool = False):
         self._prompt_session = PromptSession(history=InMemoryHistory())
-        self._completer = WordCompleter(
-            words=["!!exit", "!!reset"], pattern=re.compile("$")
-        )
+        self._completer = _COMPLETER
         self._console = Console()
         self._multiline = multiline
         self._mouse = mouse
@@ -85,7 +142,7 @@ class RichChatIO(ChatIO):
             completer=self._completer,
             multiline=False,
             mouse_support=self._mouse,
-            auto_suggest=AutoSuggestFromHistory(),
+            auto_suggest=_AUTO_SUGGEST,
             key_bindings=self.bindings if self._multiline else None,
         )
         self._console.print()
@@ -94,6 +151,35 @@ class RichChatIO(ChatIO):
     def prompt_for_output(self, role: str):
         self._console.print(f"[bold]{role}:")
 
+    @classmethod
+    def _render_markdown(cls, text):
+        """Render text as Markdown with chatbot-style line breaks."""
+        # NOTE: this is a workaround for the rendering "unstandard markdown"
+        #  in rich. The chatbots output treat "\n" as a new line for
+        #  better compatibility with real-world text. However, rendering
+        #  in markdown would break the format. It is because standard markdown
+        #  treat a single "\n" in normal text as a space.
+        #  Our workaround is adding two spaces at the end of each line.
+        #  This is not a perfect solution, as it would
+        #  introduce trailing spaces (only) in code block, but it works well
+        #  especially for console output, because in general the console does not
+        #  care about trailing spaces.
+        patched = text.replace("\n", "  \n")
+        # Code block markers - do not add trailing spaces after them, as it
+        #  would break the syntax highlighting. The replace above preserves
+        #  line starts, so the fence regex can run on the patched text.
+        pieces = []
+        last = 0
+        for match in cls._FENCE_RE.finditer(patched):
+            eol = patched.find("  \n", match.start())
+            if eol == -1:
+                continue
+            pieces.append(patched[last:eol])
+            pieces.append("\n")
+            last = eol + 3
+        pieces.append(patched[last:])
+        return Markdown("".join(pieces))
+
     def stream_output(self, output_stream):
         """Stream output from a role."""
         # TODO(suquark): the console flickers when there is a code block
@@ -101,34 +187,43 @@ class RichChatIO(ChatIO):
 
         # Create a Live context for updating the console output
         with Live(console=self._console, refresh_per_second=4) as live:
+            text = ""
+            last_flush = 0.0
+            last_fences = 0
+            prefix_end = 0
+            prefix_markdown = None
             # Read lines from the stream
             for outputs in output_stream:
                 if not outputs:
                     continue
                 text = outputs["text"]
-                # Render the accumulated text as Markdown
-                # NOTE: this is a workaround for the rendering "unstandard markdown"
-                #  in rich. The chatbots output treat "\n" as a new line for
-                #  better compatibility with real-world text. However, rendering
-                #  in markdown would break the format. It is because standard markdown
-                #  treat a single "\n" in normal text as a space.
-                #  Our workaround is adding two spaces at the end of each line.
-                #  This is not a perfect solution, as it would
-                #  introduce trailing spaces (only) in code block, but it works well
-                #  especially for console output, because in general the console does not
-                #  care about trailing spaces.
-                lines = []
-                for line in text.splitlines():
-                    lines.append(line)
-                    if line.startswith("```"):
-                        # Code block marker - do not add trailing spaces, as it would
-                        #  break the syntax highlighting
-                        lines.append("\n")
-                    else:
-                        lines.append("  \n")
-                markdown = Markdown("".join(lines))
+                # Re-parsing the whole accumulated text as Markdown for every
+                # streamed token dominates the loop cost, so only refresh at
+                # the Live refresh rate (or immediately when a code fence
+                # opens/closes, which changes how earlier lines render).
+                now = time.monotonic()
+                fences = text.count("```")
+                if now - last_flush < 0.25 and fences == last_fences:
+                    continue
+                last_flush = now
+                last_fences = fences
+                # Cache the rendered Markdown for the stable prefix (up to the
+                # last paragraph break outside any code block) so only the
+                # trailing block is re-parsed on each refresh.
+                split = text.rfind("\n\n")
+                if split >= 0 and text.count("```", 0, split) % 2 == 0:
+                    split += 2
+                    if split != prefix_end or prefix_markdown is None:
+                        prefix_end = split
+                        prefix_markdown = self._render_markdown(text[:split])
+                    markdown = Group(
+                        prefix_markdown, self._render_markdown(text[split:])
+                    )
+                else:
+                    markdown = self._render_markdown(text)
                 # Update the Live console output
                 live.update(markdown)
+            live.update(self._render_markdown(text))
         self._console.print()
         return text
 
@@ -136,30 +231,46 @@ class RichChatIO(ChatIO):
 class FileInputChatIO(ChatIO):
     def __init__(self, input_file):
         self._input_file = input_file
+        self._fd = -1
+        self._ino = None
+        self._cache_key = None
+        self._cache = None
 
     def prompt_for_input(self, role) -> str:
-        with open(self._input_file, 'r') as f:
-            contents = f.read()
-        print(f"[!OP:{role}]: {contents}", flush=True)
+        # Re-read and re-decode the file only when it actually changed;
+        # repeated turns on an unchanged prompt hit the cache. The file is
+        # kept open so a changed prompt costs a single pread with no extra
+        # path lookup; a rename-replace shows up as a new inode and
+        # triggers a reopen.
+        st = os.stat(self._input_file)
+        if st.st_ino != self._ino:
+            if self._fd >= 0:
+                os.close(self._fd)
+            self._fd = os.open(self._input_file, os.O_RDONLY)
+            self._ino = st.st_ino
+        cache_key = (st.st_mtime_ns, st.st_size)
+        if cache_key != self._cache_key:
+            self._cache = os.pread(self._fd, st.st_size, 0).decode("utf-8")
+            self._cache_key = cache_key
+        contents = self._cache
+        sys.stdout.write(f"[!OP:{role}]: {contents}\n")
+        sys.stdout.flush()
         return contents
 
     def prompt_for_output(self, role: str):
-        print(f"[!OP:{role}]: ", end="", flush=True)
+        sys.stdout.write(f"[!OP:{role}]: ")
+        sys.stdout.flush()
 
     def stream_output(self, output_stream):
-        pre = 0
-        for outputs in output_stream:
-            output_text = outputs["text"]
-            output_text = output_text.strip().split(" ")
-            now = len(output_text) - 1
-            if now > pre:
-                print(" ".join(output_text[pre:now]), end=" ", flush=True)
-                pre = now
-        print(" ".join(output_text[pre:]), flush=True)
-        return " ".join(output_text)
+        return _stream_output_to_stdout(output_stream)
 
 
 def main(args):
+    # Push text writes straight through to the underlying buffer so the
+    # streaming paths can use plain sys.stdout.write; the prompt methods
+    # keep a single explicit flush where output must appear before we
+    # block on input.
+    sys.stdout.reconfigure(write_through=True)
     if args.gpus:
         if len(args.gpus.split(",")) < args.num_gpus:
             raise ValueError(
@@ -173,11 +284,7 @@ def main(args):
     elif args.style == "rich":
         chatio = RichChatIO(args.multiline, args.mouse)
     elif args.style == "programmatic":
-        input_file_name = "input_prompt.txt" 
-        inputs_directory = "inputs"  
-        root_input_file = os.path.join(inputs_directory, input_file_name)
-        root_input_file_path = os.path.abspath(root_input_file)
-        chatio = FileInputChatIO(root_input_file_path)
+        chatio = FileInputChatIO(_DEFAULT_INPUT_PATH)
     else:
         raise ValueError(f"Invalid style for console: {args.style}")
     try: